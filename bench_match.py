@@ -0,0 +1,61 @@
+# %%
+# benchmark for InatUtils.match_waypoints: times matching N synthetic photos against a 300k-point track,
+# for N from 1,000 to 100,000. Time per photo should stay roughly flat (linear scaling).
+# run from the repo root: python bench_match.py
+import datetime
+import os
+import tempfile
+import time
+
+import numpy as np
+import PIL.Image
+
+from inatutils import InatUtils
+from utils import tools
+
+TRACK_POINTS = 300_000
+PHOTO_COUNTS = [1_000, 10_000, 100_000]
+
+# a single real file backs every Img; metadata is passed in so no EXIF is read
+tmp = tempfile.mkdtemp()
+photo_path = os.path.join(tmp, "photo.jpg")
+PIL.Image.new("RGB", (8, 8)).save(photo_path)
+
+iu = InatUtils(photo_dir=None, gpx_dir=None, log_level="WARNING", request_rate=None)
+
+# a 1 Hz track starting 2024-05-01 08:00 local (-8)
+start = np.datetime64("2024-05-01T16:00:00", "ns").astype(np.int64)
+t = start + np.arange(TRACK_POINTS, dtype=np.int64) * 1_000_000_000
+iu.waypoints = tools.WaypointStore(
+    t=t,
+    x=-122.0 + np.arange(TRACK_POINTS) * 1e-5,
+    y=45.0 + np.arange(TRACK_POINTS) * 1e-5,
+    z=np.full(TRACK_POINTS, 100.0, dtype=np.float32),
+    src=np.zeros(TRACK_POINTS, dtype=np.int16),
+    sources=["synthetic.gpx"],
+)
+
+rng = np.random.default_rng(0)
+print(f"matching against {TRACK_POINTS:,} trackpoints")
+for n in PHOTO_COUNTS:
+    seconds = np.sort(rng.integers(0, TRACK_POINTS, n))
+    iu.photos = [
+        InatUtils.Img(
+            path=photo_path,
+            offset=-8,
+            metadata={
+                "timestamp": (
+                    datetime.datetime(2024, 5, 1, 8)
+                    + datetime.timedelta(seconds=int(s))
+                ).strftime("%Y:%m:%d %H:%M:%S")
+            },
+        )
+        for s in seconds
+    ]
+    tic = time.perf_counter()
+    iu.match_waypoints()
+    elapsed = time.perf_counter() - tic
+    print(f"{n:>9,} photos  {elapsed:7.3f} s  {elapsed / n * 1e6:6.2f} us/photo")
+
+iu.close()
+# %%
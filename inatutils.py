@@ -1,16 +1,21 @@
 # %%
+import asyncio
 import json
 import PIL.Image
 import requests
 import os
 import sys
+import threading
 import uuid
 from pprint import pprint
 import logging
 import PIL
-import datetime
 import pandas as pd
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from itertools import islice
 
 # import oauthlib
 
@@ -34,6 +39,17 @@ class InatUtils:
         time_delta_threshold=None,
         camera_make: str = None,
         camera_model: str = None,
+        workers: int = 1,
+        gpx_workers: int = 1,
+        export_workers: int = 1,
+        metadata_cache: str = None,
+        match_method: str = "nearest",
+        max_interpolation_gap: float = 60,
+        cache_waypoints: bool = False,
+        client: tools.InatClient = None,
+        cv_max_edge: int = 1024,
+        cv_cache: str = None,
+        request_rate: float = 1.0,
     ):
         """
         Initialize the InatUtils class.
@@ -42,18 +58,29 @@ class InatUtils:
             gpx_dir (str): Directory containing GPX files to georeference with. Default is "in_gpx".
             output_dir (str): Directory to save processed photos. Default is "out_photos".
             gmt_offset (int): GMT offset, representing the timezone in which the photos were taken, for timestamp conversion. Default is -8 (LA/Vancouver).
-            token (str, optional): Authentication token for the iNaturalist computer vision service. Default is None.
+            token (str, optional): Authentication token for the iNaturalist computer vision service. It is refreshed in the background before its JWT expiry, from the first time it is used; if None, one is fetched when first needed.
             trusted_genera (list): List of trusted genera for identification. Default is an empty list.
             log_level (str): Logging level. Default is "INFO".
             min_score (int | float): Minimum score for organism identification. Default is 75.
             common_ancestor_ok (bool): Decides wether the common ancestor (typically Genus or Family rank) of all low-scoring IDs can be used as an identification, in the absence of a well-scored ID. Default is True.
             timestamp_fmt (str): Format for photo timestamps. Default is "%Y-%m-%d %H:%M:%S".
             time_delta_threshold (optional): Threshold for time delta. Default is None.
+            workers (int): Number of parallel workers used to load photos. Default is 1 (sequential).
+            gpx_workers (int): Number of processes used to parse GPX files. Like any process pool, more than 1 needs the calling script's top-level code under `if __name__ == "__main__":` on Windows and macOS. Default is 1 (sequential).
+            export_workers (int): Number of processes save() encodes exports across; the same `__main__` guard applies. Default is 1 (sequential).
+            metadata_cache (str, optional): Path to a SQLite file caching photo metadata between runs, so unchanged photos aren't re-read. Default is None (no cache).
+            cache_waypoints (bool): Cache parsed GPX tracks as memory-mapped arrays next to each GPX file (e.g. in_gpx/.track.gpx.npy/), so later sessions reopen them without parsing. Default is False.
+            client (tools.InatClient, optional): HTTP client for iNaturalist API calls (connection pool size, retries, base URL override). Default is None, which creates one owned by this instance; call close() when done.
+            request_rate (float): Maximum sustained API requests per second for the client this instance creates (see tools.RequestScheduler); None disables pacing. Ignored if `client` is given. This also caps identify()'s throughput at any `concurrency`. Default is 1.0.
+            cv_max_edge (int): Photos are downscaled to fit within this many pixels and re-encoded as JPEG before being sent to the computer vision model; None sends the original files. Default is 1024.
+            cv_cache (str, optional): Path to a SQLite file caching raw computer vision responses by image content, so re-identifying unchanged images needs no requests. Default is None (no cache).
+            match_method (str): How photos are positioned on GPX tracks: "nearest" snaps to the closest trackpoint in time, "interpolate" interpolates between the bracketing trackpoints. Default is "nearest".
+            max_interpolation_gap (float): With match_method="interpolate", photos between trackpoints more than this many minutes apart (e.g. across a night the logger was off) snap to the nearest trackpoint instead; None always interpolates. Default is 60.
         """
         self.photos = []
         self.georeferenced_percent = 0.0
         self.identified_percent = 0.0
-        self.waypoints = pd.DataFrame(columns=["x", "y", "z", "t", "geo_src"])
+        self.waypoints = tools.WaypointStore()
         self.time_range = None
         self.bbox = None
         self.trusted_genera = trusted_genera
@@ -65,13 +92,38 @@ class InatUtils:
         self.gpx_dir = gpx_dir
         self.gpx_dir_valid = False
         self.output_dir = output_dir
-        self.token = token
         self.offset = gmt_offset
         self.camera_make = camera_make
         self.camera_model = camera_model
         self.timestamp_fmt = timestamp_fmt
         self.photo_formats = ["jpg", "cr2", "jpeg", "heic"]
         self.log_level = log_level
+        self.workers = workers
+        self.gpx_workers = gpx_workers
+        self.export_workers = export_workers
+        self.match_method = match_method
+        self.max_interpolation_gap = max_interpolation_gap
+        self.cache_waypoints = cache_waypoints
+        self._owns_client = client is None
+        self.cv_max_edge = cv_max_edge
+        self.cv_cache = tools.CVResponseCache(cv_cache) if cv_cache else None
+        if not client:
+            client = tools.InatClient(
+                scheduler=(
+                    tools.RequestScheduler(
+                        rate=request_rate, burst=max(1, int(request_rate))
+                    )
+                    if request_rate
+                    else None
+                )
+            )
+        self.client = client
+        self.tokens = tools.TokenProvider(token, client=self.client)
+        self.load_errors = {}
+        self._names_lock = threading.Lock()
+        self.metadata_cache = (
+            tools.PhotoMetadataCache(metadata_cache) if metadata_cache else None
+        )
         logging.basicConfig(
             format="%(levelname)s:%(module)s:%(funcName)s:%(lineno)d:%(message)s"
         )
@@ -90,10 +142,30 @@ class InatUtils:
         if self.photos:
             self.sort()
 
-        if token:
-            self.token = token
-        else:
-            self.token = tools.refresh_token()
+    @property
+    def token(self) -> str | None:
+        return self.tokens.get()
+
+    @token.setter
+    def token(self, value: str):
+        self.tokens.set(value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """stops token refreshing, releases the HTTP connection pool if this instance created it, and closes the
+        caches"""
+        self.tokens.stop()
+        if self._owns_client:
+            self.client.close()
+        if self.cv_cache:
+            self.cv_cache.close()
+        if self.metadata_cache:
+            self.metadata_cache.close()
 
     # region images
     def validate_contents(self, dir: str, expected_files: list[str]):
@@ -106,6 +178,8 @@ class InatUtils:
 
             if contents:
                 for file in contents:
+                    if file.startswith(".") and file != ".gitignore":
+                        continue  # hidden files, e.g. waypoint caches
                     file_ext = file.lower().split(".")[-1]
                     if not file_ext in expected_files:
                         logging.warning(f"unexpected file type in {dir}: {file}")
@@ -129,19 +203,33 @@ class InatUtils:
         `self.format`: file extension it was loaded from
         `self.offset`: GMT offset to apply to datetime (inherits from InatUtils)
         `self.datetime`: the photo's timestamp
+        `self.exif_datetime`: the photo's local (camera clock) timestamp, as read from EXIF
+        `self.camera_make`: camera manufacturer, as read from EXIF
+        `self.camera_model`: camera model, as read from EXIF
+        `self.camera_serial`: camera body serial number, as read from EXIF
+        `self.exif_geo`: position already present in the photo's EXIF GPS IFD, like {"x": lon, "y": lat, "z": alt}
         `self.geo`: a dict of spatiotemporal data (including nearest timestamp that could be matched)
         `self.timedelta`: the difference in minutes between actual photo time and matched waypoint time
         `self.identity`: ID from computer vision model
+        `self.cv_response`: the raw computer vision response the identity was interpreted from
+        `self.phash`: perceptual hash of the image, once computed by InatUtils.group_bursts()
         `self.georeferenced`: boolean indicating whether the image has been georeferenced
+        `self.gps`: the GPS IFD written into the exported EXIF, once georeferenced
         `self.identified`: boolean indicating whether the image has been identified
         `self.outputs`: a list of child images (e.g. exports) yielded from parent
         `self.src`: i don't remember why i added this
-        `self.raster`: the PIL image object
-        `self.exif`: the PIL image object's exif data--direct editing strongly discouraged; use self.raster.getexif() instead
+        `self.sidecar`: path of the XMP sidecar written for this image, if any
+        `self.raster`: the PIL image object (opened on access from a shared LRU of handles; see tools.configure_raster_cache)
+        `self.exif`: the PIL image object's exif data (read on first access and kept on the Img)
 
         `show()`: displays the image
+
+        NOTE: construction only reads the file's EXIF header (see tools.read_exif_header); the image itself is not
+        opened until `raster` or `exif` is accessed, and may be closed again when the shared handle cache is full.
+        To keep an edited raster, assign it to `self.raster`; assigned rasters are held by the Img, not the cache.
         """
-        def __init__(self, path: str, offset: int):
+
+        def __init__(self, path: str, offset: int, metadata: dict = None):
             self.id = str(uuid.uuid4())
             self.name = os.path.split(path)[1]
             self.folder = os.path.split(path)[0]
@@ -149,29 +237,96 @@ class InatUtils:
             self.size = os.path.getsize(self.path)
             self.format = os.path.splitext(self.path)[1]
             self.offset = offset
-            self.datetime = tools.get_exif_timestamp(
-                self.name, directory=self.folder, offset=self.offset
-            )
+            if metadata is None:
+                metadata = tools.read_exif_header(self.path)
+            self.exif_datetime = metadata.get("timestamp")
+            self.camera_make = metadata.get("make")
+            self.camera_model = metadata.get("model")
+            self.camera_serial = metadata.get("serial")
+            self.exif_geo = metadata.get("geo") or {}
+            self.datetime = None
+            if self.exif_datetime:
+                self.datetime = tools.convert_to_utc(
+                    self.exif_datetime,
+                    fmt="%Y:%m:%d %H:%M:%S",
+                    outfmt="%Y:%m:%d %H:%M:%S",
+                    local_offset=self.offset,
+                )
+            else:
+                logging.warning(f"No exif data found for {self.name}")
             self.geo = dict()
             self.timedelta = None
             self.identity = dict()
+            self.cv_response = None
+            self.phash = None
             self.georeferenced = False  # meaning in Exif, not in geo property
+            self.gps = None
             self.identified = False
             self.outputs = []
             self.src = None
-            self.raster = PIL.Image.open(self.path)
-            self.exif = self.raster.getexif()
+            self.sidecar = None
+            self._raster = None
+            self._exif = None
 
             # if self.datetime and not isinstance(self.datetime, datetime.datetime):
             #     self.datetime = datetime.datetime(self.datetime)
             #     # TODO: enforce which format here?
 
+        @property
+        def raster(self) -> PIL.Image.Image:
+            if self._raster is not None:
+                return self._raster
+            return tools.RASTER_CACHE.get(self.path)
+
+        @raster.setter
+        def raster(self, value: PIL.Image.Image):
+            self._raster = value
+
+        @property
+        def exif(self) -> PIL.Image.Exif:
+            if self._exif is None:
+                self._exif = self.raster.getexif()
+            return self._exif
+
+        @exif.setter
+        def exif(self, value: PIL.Image.Exif):
+            self._exif = value
+
+        def metadata(self) -> dict:
+            """returns the header metadata this Img was built from, in the form accepted by `Img(metadata=...)`"""
+            return {
+                "timestamp": self.exif_datetime,
+                "make": self.camera_make,
+                "model": self.camera_model,
+                "serial": self.camera_serial,
+                "geo": self.exif_geo,
+            }
+
         def show(self, size: tuple[int] = None):
+            raster = self.raster
             if size:
-                self.raster.thumbnail(size)
-            self.raster.show()
+                raster = raster.copy()
+                raster.thumbnail(size)
+            raster.show()
+
+    def load_images(
+        self,
+        photo_dir,
+        overwrite=False,
+        workers: int = None,
+        use_processes: bool = False,
+    ) -> list[Img]:
+        """loads the photos in `photo_dir` as Img objects, in directory listing order.
+
+        Args:
+            photo_dir (str): directory to load photos from.
+            overwrite (bool): replace photos that have already been loaded. Default is False.
+            workers (int, optional): number of parallel workers. Defaults to self.workers.
+            use_processes (bool): use a process pool instead of a thread pool; worthwhile when decoding-heavy formats
+                (HEIC/CR2) make loading CPU-bound rather than I/O-bound. Default is False.
 
-    def load_images(self, photo_dir, overwrite=False) -> list[Img]:
+        Files that fail to load are skipped, logged, and recorded in `self.load_errors` as {path: error message}.
+        """
         if len(self.photos) > 0 and not overwrite:
             logging.warning(
                 f"aborting load images; images have already been loaded. If you want to overwrite existing images, use this function with overwrite=True."
@@ -183,19 +338,61 @@ class InatUtils:
         if not self.validate_contents(photo_dir, self.photo_formats):
             logging.error(f"no photos found in specified photo dir {photo_dir}")
             return
+        if workers is None:
+            workers = self.workers
 
-        out_images = []
-
+        paths = []
         for pic in tools.list_photo_names(directory=photo_dir):
             if pic.startswith("."):
                 continue
             if not pic.lower().endswith(tuple(self.photo_formats)):
                 logging.warning(f"skipping {pic} due to unexpected file type")
                 continue
-            path = os.path.join(os.getcwd(), photo_dir, pic)
-            photo = self.Img(path=path, offset=self.offset)
+            paths.append(os.path.join(os.getcwd(), photo_dir, pic))
+
+        offsets = [self.offset] * len(paths)
+        stats = [None] * len(paths)
+        metadata = [None] * len(paths)
+        if self.metadata_cache:
+            stats = [os.stat(path) for path in paths]
+            metadata = [
+                self.metadata_cache.get(path, stat) for path, stat in zip(paths, stats)
+            ]
+            logging.debug(
+                f"{sum(m is not None for m in metadata)} of {len(paths)} photos found in metadata cache"
+            )
 
+        if workers and workers > 1 and len(paths) > 1:
+            pool = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            with pool(max_workers=workers) as executor:
+                results = list(
+                    executor.map(
+                        _load_img,
+                        paths,
+                        offsets,
+                        metadata,
+                        chunksize=max(1, len(paths) // (workers * 4)),
+                    )
+                )
+        else:
+            results = list(map(_load_img, paths, offsets, metadata))
+
+        out_images = []
+        self.load_errors = {}
+        for path, stat, cached, (photo, error) in zip(paths, stats, metadata, results):
+            if error:
+                logging.error(f"failed to load {path}: {error}")
+                self.load_errors[path] = error
+                continue
+            if self.metadata_cache and cached is None:
+                self.metadata_cache.put(path, photo.metadata(), stat)
             out_images.append(photo)
+        if self.metadata_cache:
+            self.metadata_cache.commit()
+
+        logging.debug(
+            f"loaded {len(out_images)} of {len(paths)} photos from {photo_dir} with {workers or 1} worker(s)"
+        )
         return out_images
 
     def sort(self, by: str = "datetime_obj", ascending: bool = True) -> list[Img]:
@@ -205,9 +402,17 @@ class InatUtils:
         return self.photos
 
     # region spatial
-    def get_waypoints(self, gpx_dir) -> None:
-        """gets waypoints from GPX files in a directory and adds them to the waypoints dataframe.
-        NOTE: timestamps are in utc
+    def get_waypoints(self, gpx_dir, workers: int = None) -> None:
+        """gets waypoints from GPX files in a directory and adds them to the waypoint store.
+        NOTE: timestamps ("t") are in utc, as int64 epoch nanoseconds
+
+        Args:
+            gpx_dir (str): directory containing GPX files.
+            workers (int, optional): number of GPX files to parse concurrently, in separate processes. Defaults to self.gpx_workers.
+
+        Trackpoints that are already loaded (same t, x and y) are dropped, so overlapping tracks or repeated calls
+        don't duplicate waypoints. With `self.cache_waypoints`, unchanged GPX files are reopened from their cache
+        instead of being parsed.
         """
         if not gpx_dir and self.gpx_dir != None:
             gpx_dir = self.gpx_dir
@@ -224,25 +429,51 @@ class InatUtils:
         gpx_files = [
             os.path.join(gpx_dir, f)
             for f in tools.list_gpx_files(directory=gpx_dir)
-            if f != ".gitignore"
+            if f.lower().endswith(".gpx") and not f.startswith(".")
         ]
         if not gpx_files:
             logging.warning(f"no gpx files found in {gpx_dir}")
             return
+        if workers is None:
+            workers = self.gpx_workers
 
+        stores = [self.waypoints]
+        to_parse = []
         for gpx in gpx_files:
-            if ".gitignore" in gpx:
-                continue
-            waypoints = tools.parse_gpx(gpx)
-            if len(waypoints) and len(waypoints) != len(self.waypoints):
-                self.waypoints = pd.concat(
-                    [self.waypoints, waypoints], ignore_index=True
-                )
+            cached = (
+                tools.WaypointStore.load_cached(gpx) if self.cache_waypoints else None
+            )
+            if cached is None:
+                to_parse.append(gpx)
+            else:
+                stores.append(cached)
+
+        caches = [self.cache_waypoints] * len(to_parse)
+        if workers and workers > 1 and len(to_parse) > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(to_parse))
+            ) as executor:
+                results = list(executor.map(_read_gpx, to_parse, caches))
+        else:
+            results = list(map(_read_gpx, to_parse, caches))
 
+        for gpx, (store, error) in zip(to_parse, results):
+            if error:
+                logging.error(f"failed to parse {gpx}: {error}")
+            else:
+                stores.append(store)
+
+        self.waypoints = tools.WaypointStore.concat(stores)
         logging.debug(
-            f"{len(self.waypoints)} waypoints created from {len(gpx_files)} gpx files"
+            f"{len(self.waypoints)} waypoints ({self.waypoints.nbytes / 1e6:.1f} MB) from {len(gpx_files)} gpx files, {len(gpx_files) - len(to_parse)} from cache"
         )
 
+    def waypoints_df(self) -> pd.DataFrame:
+        if self.waypoints.empty:
+            logging.error(f"no waypoints loaded")
+            return pd.DataFrame()
+        return self.waypoints.to_frame()
+
     def photos_df(self, get_ts_obj=True, keep_img_obj=True) -> pd.DataFrame:
         if len(self.photos) == 0:
             logging.error(f"no photos loaded")
@@ -256,53 +487,76 @@ class InatUtils:
             pdf["img_obj"] = pdf["id"].map({p.id: p for p in self.photos})
         return pdf
 
-    def match_waypoints(self):
-        photosdf = self.photos_df()
+    def match_waypoints(
+        self, method: str = None, photos: list[Img] = None, max_gap: float = None
+    ):
+        """locates each photo on the GPX tracks by time and stores the result in `Img.geo`/`Img.timedelta`
+
+        Args:
+            method (str, optional): "nearest" or "interpolate" (see tools.match_positions). Defaults to self.match_method.
+            photos (list[Img], optional): the photos to match. Defaults to self.photos.
+            max_gap (float, optional): in interpolate mode, the longest gap in minutes to interpolate across. Defaults to self.max_interpolation_gap.
+        """
+        if photos is None:
+            photos = self.photos
+        if not method:
+            method = self.match_method
+        if max_gap is None:
+            max_gap = self.max_interpolation_gap
+        if method not in ("nearest", "interpolate"):
+            logging.error(f"match method {method} not recognized")
+            return
         if self.waypoints.empty:
             logging.warning(
                 f"no photos will be georeferenced because there are no waypoints."
             )
             return
-        elif photosdf.empty:
+        elif not photos:
             logging.warning(
                 f"there are no photos to georeference! Load some with InatUtils.load_images()."
             )
             return
-        photosdf = self.photos_df()
-        self.waypoints["t_obj"] = pd.to_datetime(
-            self.waypoints["t"], format=self.timestamp_fmt
+
+        photo_t = tools.to_epoch_ns(
+            [p.datetime for p in photos], fmt=self.timestamp_fmt
         )
-        nearest_waypoints = pd.merge_asof(
-            photosdf.sort_values("datetime_obj"),
-            self.waypoints.sort_values("t_obj"),
-            left_on="datetime_obj",
-            right_on="t_obj",
-            direction="nearest",
+        timed = photo_t != tools.NAT_NS
+        wp = self.waypoints
+        match = tools.match_positions(
+            photo_t[timed],
+            wp.t,
+            wp.x,
+            wp.y,
+            wp.z.astype(np.float64),
+            interpolate=method == "interpolate",
+            max_gap=int(max_gap * 6e10) if max_gap is not None else None,
         )
-        nearest_waypoints["delta"] = (
-            nearest_waypoints["datetime_obj"] - nearest_waypoints["t_obj"]
-        ).abs().dt.total_seconds() / 60
 
-        for p in self.photos:
-            if not p.datetime:
+        # build every photo's geo dict column-wise, then hand them out in one pass
+        matched = pd.DataFrame(
+            {
+                "x": match["x"],
+                "y": match["y"],
+                "z": match["z"],
+                "t": pd.to_datetime(match["t"], unit="ns").strftime(self.timestamp_fmt),
+                "geo_src": np.array(wp.sources, dtype=object)[wp.src[match["index"]]],
+                "delta": match["delta"],
+            }
+        ).fillna(0)
+        lat_refs = np.where(matched["y"] >= 0, "N", "S")
+        lon_refs = np.where(matched["x"] >= 0, "E", "W")
+        geos = iter(matched.to_dict("records"))
+        refs = zip(lat_refs, lon_refs)
+
+        for p, has_time in zip(photos, timed):
+            if not has_time:
                 logging.debug(f"{p.name} has no timestamp and cannot be georeferenced")
                 continue
-            logging.debug(f"locating {p.name}...")
-
-            closest_waypoint = nearest_waypoints.loc[
-                nearest_waypoints["id"] == p.id
-            ].iloc[0]
-            p.geo = closest_waypoint[["x", "y", "z", "t", "geo_src", "delta"]].to_dict()
-            p.timedelta = p.geo["delta"]
-
-            ref = tools.get_reference_direction(lat=p.geo["y"], lon=p.geo["x"])
-            p.geo["ref"] = ref
-
-            for k, v in p.geo.items():
-                if isinstance(v, datetime.datetime):
-                    p.geo[k] = v.strftime(self.timestamp_fmt)
-                elif pd.isna(v):
-                    p.geo[k] = 0
+            geo = next(geos)
+            lat_ref, lon_ref = next(refs)
+            geo["ref"] = {"lat": str(lat_ref), "lon": str(lon_ref)}
+            p.geo = geo
+            p.timedelta = geo["delta"]
 
     def georeference_image(self, photo: Img | str | int):
         p = None
@@ -321,15 +575,13 @@ class InatUtils:
         if not p:
             logging.error(f"no photo found for input {p}")
             return
-        try:
-            exif = p.exif
-            geo = p.geo
-            ref = p.geo.get("ref", None)
-        except Exception as e:
-            logging.error(e)
+        # only the GPS IFD is built here; it's merged into the EXIF at export (see _export_exif), so georeferencing
+        # never has to open the image
+        geo = p.geo
+        ref = geo.get("ref", None) if geo else None
 
-        if exif and geo and ref:
-            gps_value = {
+        if geo and ref:
+            p.gps = {
                 0: b"\x02\x03\x00\x00",  # GPSVersionID
                 1: ref["lat"],  # GPSLatitudeRef
                 2: tools.get_dms_from_decimal(abs(p.geo["y"])),  # GPSLatitude
@@ -340,17 +592,19 @@ class InatUtils:
                 9: "A",  # GPSStatus
                 18: "WGS-84\x00",  # GPSMapDatum
             }
+            p.georeferenced = True
+        self.update_georeferenced_percent()
 
-            p.exif[34853] = gps_value
-
+    def _export_exif(self, p: Img) -> PIL.Image.Exif:
+        """returns the photo's EXIF with its GPS IFD and camera make/model (if georeferenced) merged in, for export"""
+        exif = p.exif
+        if p.gps:
+            exif[34853] = p.gps
             if self.camera_make:
-                p.exif[271] = self.camera_make
-
+                exif[271] = self.camera_make
             if self.camera_model:
-                p.exif[272] = self.camera_model
-
-            p.georeferenced = True
-        self.update_georeferenced_percent()
+                exif[272] = self.camera_model
+        return exif
 
     def update_georeferenced_percent(self):
         self.georeferenced_percent = (
@@ -372,8 +626,291 @@ class InatUtils:
             else 0.0
         )
 
+    def sweep_offsets(
+        self, offsets, max_timedelta: float = None, photos: list[Img] = None
+    ) -> pd.DataFrame:
+        """scores candidate clock offsets against the loaded waypoints, without touching the photos.
+
+        Args:
+            offsets (list | np.ndarray): candidate offsets in hours (fractions allowed), each as would be passed to
+                apply_offset().
+            max_timedelta (float, optional): count a photo as matched when it's within this many minutes of a
+                trackpoint. Default is None (every photo counts).
+            photos (list[Img], optional): the photos to score. Defaults to self.photos.
+
+        Returns:
+            pd.DataFrame: one row per offset: "offset" (hours), "mean_delta", "median_delta", "max_delta"
+                (minutes) and "matched" (number of photos within max_timedelta), sorted by mean_delta.
+        """
+        if photos is None:
+            photos = self.photos
+        offsets = np.atleast_1d(np.asarray(offsets, dtype=np.float64))
+        photo_t = tools.to_epoch_ns(
+            [p.datetime for p in photos], fmt=self.timestamp_fmt
+        )
+        stats = tools.sweep_offsets(
+            photo_t,
+            self.waypoints.t,
+            np.round(offsets * 3.6e12).astype(np.int64),
+            max_gap=None if max_timedelta is None else int(max_timedelta * 6e10),
+        )
+        return pd.DataFrame(
+            {
+                "offset": offsets,
+                "mean_delta": stats["mean"],
+                "median_delta": stats["median"],
+                "max_delta": stats["max"],
+                "matched": stats["matched"],
+            }
+        ).sort_values("mean_delta", ignore_index=True)
+
+    def apply_offset(self, hours: float, photos: list[Img] = None):
+        """shifts photos' UTC datetimes by `hours` (e.g. to correct a camera clock), then re-matches and
+        re-georeferences them against the already-loaded waypoints.
+
+        Args:
+            hours (float): hours to add to each photo's datetime; negative to subtract.
+            photos (list[Img], optional): the photos to shift. Defaults to self.photos.
+        """
+        if photos is None:
+            photos = self.photos
+        self._shift_photos(photos, lambda t: np.int64(round(hours * 3.6e12)))
+
+    def _shift_photos(self, photos: list[Img], shift):
+        """adds `shift(photo_t)` (ns, one value or one per photo) to the photos' datetimes in one vectorized pass,
+        then re-matches and re-georeferences them"""
+        photo_t = tools.to_epoch_ns(
+            [p.datetime for p in photos], fmt=self.timestamp_fmt
+        )
+        timed = photo_t != tools.NAT_NS
+        shifted = pd.to_datetime(
+            photo_t[timed] + shift(photo_t[timed]), unit="ns"
+        ).strftime(self.timestamp_fmt)
+        for p, datetime_str in zip((p for p, t in zip(photos, timed) if t), shifted):
+            p.datetime = datetime_str
+        self.match_waypoints(photos=photos)
+        for p in photos:
+            try:
+                self.georeference_image(p)
+            except Exception as e:
+                logging.error(e)
+
+    def estimate_offsets(
+        self,
+        coarse=None,
+        refine_step: float = 1 / 60,
+        max_timedelta: float = 5,
+        apply: bool = True,
+    ) -> pd.DataFrame:
+        """estimates a clock offset for each camera, and (by default) applies it, so that a shoot with several bodies
+        set to different or wrong clocks lines up with the GPX tracks.
+
+        Photos are grouped by EXIF camera make, model and serial number. For each group, every offset in `coarse`
+        is scored against the loaded waypoints (see tools.estimate_offset), then the best is refined in steps of
+        `refine_step` hours. The winner is the offset that puts the most photos within `max_timedelta` minutes of a
+        trackpoint, then the fewest off the track. Offsets that keep the same photos on the track fit equally well;
+        the middle of that range is taken, and its width is reported as "ambiguity". On a continuous track with no
+        photos near its ends, the range is wide, so a camera whose ambiguity is wider than `refine_step` is left as
+        is.
+
+        Args:
+            coarse (list | np.ndarray, optional): candidate offsets in hours for the first pass. Default is -14h to
+                +14h in 15 minute steps.
+            refine_step (float): step in hours of the second pass. Default is 1 minute.
+            max_timedelta (float): minutes within which a photo counts as on-track. Default is 5.
+            apply (bool): shift each group's photos by its offset and re-match them (see apply_offset()), unless the
+                offset is ambiguous. Default is True.
+
+        Returns:
+            pd.DataFrame: one row per camera with timed photos: "make", "model", "serial", "photos", "offset"
+                (hours), "ambiguity" (hours), "applied", "matched", "mean_delta" and "median_delta" (minutes) at that
+                offset.
+        """
+        if self.waypoints.empty:
+            logging.error("cannot estimate offsets; no waypoints are loaded")
+            return pd.DataFrame()
+        if coarse is None:
+            coarse = np.arange(-14, 14.25, 0.25)
+        coarse = np.round(np.asarray(coarse, dtype=np.float64) * 3.6e12)
+
+        cameras = {}
+        for p in self.photos:
+            key = (p.camera_make, p.camera_model, p.camera_serial)
+            cameras.setdefault(key, []).append(p)
+
+        rows = []
+        for (make, model, serial), photos in cameras.items():
+            photo_t = tools.to_epoch_ns(
+                [p.datetime for p in photos], fmt=self.timestamp_fmt
+            )
+            if not (photo_t != tools.NAT_NS).any():
+                logging.warning(
+                    f"{make} {model} ({serial}): no photos with timestamps; skipping"
+                )
+                continue
+            step = int(round(refine_step * 3.6e12))
+            offset, stats = tools.estimate_offset(
+                photo_t,
+                self.waypoints.t,
+                coarse,
+                refine_step=step,
+                max_gap=int(max_timedelta * 6e10),
+            )
+            if offset is None:
+                continue
+            hours = offset / 3.6e12
+            ambiguous = stats["ambiguity"] > step
+            logging.info(
+                f"{make} {model} ({serial}): {hours:+.3f}h puts {stats['matched']} of {len(photos)} photos within {max_timedelta} minutes of a trackpoint"
+            )
+            if ambiguous:
+                logging.warning(
+                    f"{make} {model} ({serial}): offsets across {stats['ambiguity'] / 3.6e12:.2f}h fit equally well; not applying an offset"
+                )
+            applied = bool(apply and offset and not ambiguous)
+            if applied:
+                self.apply_offset(hours, photos=photos)
+            rows.append(
+                {
+                    "make": make,
+                    "model": model,
+                    "serial": serial,
+                    "photos": len(photos),
+                    "offset": hours,
+                    "ambiguity": stats["ambiguity"] / 3.6e12,
+                    "applied": applied,
+                    "matched": stats["matched"],
+                    "mean_delta": stats["mean"],
+                    "median_delta": stats["median"],
+                }
+            )
+        if apply:
+            self.update_georeferenced_percent()
+        return pd.DataFrame(rows)
+
+    def fit_clock_drift(
+        self,
+        references: dict = None,
+        photos: list[Img] = None,
+        window: float = 24,
+        piecewise: bool = False,
+        max_drift: float = 10,
+        refine_step: float = 10 / 3600,
+        max_timedelta: float = 5,
+        min_photos: int = 5,
+        max_ambiguity: float = 10,
+        apply: bool = True,
+    ) -> tools.ClockDriftModel | None:
+        """fits a linear model of a camera clock's drift (an offset plus a rate, see tools.ClockDriftModel) and, by
+        default, corrects every photo's datetime with it before re-matching, for trips long enough that a single
+        offset leaves late photos mismatched.
+
+        The model is fitted with least squares to samples of the clock error. With `references`, each sample is a
+        photo whose true time is known (e.g. a shot of a phone or GPS clock). Otherwise an offset for all the photos is
+        estimated against the GPX tracks as in estimate_offsets(), the photos are split into `window`-hour windows,
+        and each window's offset is estimated within `max_drift` minutes of it. Within a continuous track many
+        offsets fit equally well (see tools.estimate_offset); it's photos near the track's ends and gaps that fix the
+        clock. Each window therefore contributes the middle of its tied range, weighted by the range's width, and
+        windows the track barely constrains are left out. If fewer than two windows are usable, no model is fitted.
+
+        Args:
+            references (dict, optional): {Img or photo name: true UTC time, formatted as self.timestamp_fmt}.
+            photos (list[Img], optional): the photos from the camera to fit and correct. Defaults to self.photos;
+                pass one camera's photos when several were used (see estimate_offsets()).
+            window (float): hours of photos per offset estimate when fitting against the tracks. Default is 24.
+            piecewise (bool): let the rate change at every day from the first sample, e.g. for a clock that drifts
+                with temperature; needs several windows per day. Default is False.
+            max_drift (float): minutes either side of the whole set's best offset that each window's offset is
+                searched within. Default is 10.
+            refine_step (float): step in hours of each window's fine pass. Default is 10 seconds.
+            max_timedelta (float): minutes within which a photo counts as on-track. Default is 5.
+            min_photos (int): windows with fewer photos, or with fewer than half on-track at their best offset, are
+                left out of the fit. Default is 5.
+            max_ambiguity (float): windows whose equally good offsets span more than this many minutes are left out
+                of the fit. Default is 10.
+            apply (bool): correct the photos' datetimes and re-match them. Default is True.
+
+        Returns:
+            tools.ClockDriftModel: the fitted model, or None if there were fewer than two usable samples to fit.
+        """
+        if photos is None:
+            photos = self.photos
+
+        if references:
+            by_name = {p.name: p for p in self.photos}
+            refs = [
+                (by_name.get(p, p) if isinstance(p, str) else p, true_time)
+                for p, true_time in references.items()
+            ]
+            refs = [(p, t) for p, t in refs if isinstance(p, self.Img)]
+            sample_t = tools.to_epoch_ns(
+                [p.datetime for p, _ in refs], fmt=self.timestamp_fmt
+            )
+            true_t = tools.to_epoch_ns([t for _, t in refs], fmt=self.timestamp_fmt)
+            valid = (sample_t != tools.NAT_NS) & (true_t != tools.NAT_NS)
+            sample_t, corrections = sample_t[valid], (true_t - sample_t)[valid]
+            uncertainty = None
+        else:
+            if self.waypoints.empty:
+                logging.error("cannot fit clock drift; no waypoints or references")
+                return None
+            photo_t = tools.to_epoch_ns(
+                [p.datetime for p in photos], fmt=self.timestamp_fmt
+            )
+            photo_t = np.sort(photo_t[photo_t != tools.NAT_NS])
+            if not len(photo_t):
+                logging.error("cannot fit clock drift; no photos have timestamps")
+                return None
+            max_gap = int(max_timedelta * 6e10)
+            refine_step = int(round(refine_step * 3.6e12))
+            overall, _ = tools.estimate_offset(
+                photo_t,
+                self.waypoints.t,
+                np.arange(-14 * 3.6e12, 14.25 * 3.6e12, 9e11),
+                refine_step=refine_step,
+                max_gap=max_gap,
+            )
+            if overall is None:
+                logging.error("cannot fit clock drift; no photos could be compared")
+                return None
+            sample_t, corrections, uncertainty = tools.drift_samples(
+                photo_t,
+                self.waypoints.t,
+                overall,
+                window=int(window * 3.6e12),
+                max_drift=int(max_drift * 6e10),
+                refine_step=refine_step,
+                max_gap=max_gap,
+                min_photos=min_photos,
+                max_ambiguity=int(max_ambiguity * 6e10),
+            )
+
+        if len(sample_t) < 2:
+            logging.error(
+                f"cannot fit clock drift from {len(sample_t)} usable sample(s); need at least 2"
+            )
+            return None
+        model = tools.ClockDriftModel.fit(
+            sample_t, corrections, piecewise=piecewise, uncertainty=uncertainty
+        )
+        logging.info(
+            f"clock drift: {model.offset:+.1f}s at {model.start}, {model.rate:+.2f}s/day (rms residual {model.rms:.1f}s over {len(sample_t)} samples)"
+        )
+        if apply:
+            self._shift_photos(photos, model.correction)
+        return model
+
     # region id
 
+    def _apply_identification(self, p: Img, identification: dict | None):
+        if identification:
+            p.identity = identification
+            p.identified = True
+            if p.outputs:  # if has child images, they're also IDd now
+                for o in p.outputs:
+                    o.identity = identification
+                    o.identified = True
+
     def identify_image(self, photo: Img | str | int, min_score=None, overwrite=None):
         if not min_score:
             min_score = self.min_score
@@ -398,19 +935,20 @@ class InatUtils:
                     logging.warning(
                         f"image {p.name} is already identified; use this function with overwrite=True to overwrite existing ID"
                     )
-                res = tools.get_cv_ids(p.path, token=self.token)
+                res = tools.get_cv_ids(
+                    p.path,
+                    token=self.token,
+                    client=self.client,
+                    max_edge=self.cv_max_edge,
+                    cache=self.cv_cache,
+                )
+                p.cv_response = res
                 identification = tools.interpret_results(
                     res,
                     confidence_threshold=min_score,
                     common_ancestor_ok=self.common_ancestor_ok,
                 )
-                if identification:
-                    p.identity = identification
-                    p.identified = True
-                    if p.outputs:  # if has child images, they're also IDd now
-                        for o in p.outputs:
-                            o.identity = identification
-                            o.identified = True
+                self._apply_identification(p, identification)
 
                 self.update_identified_percent()
             except Exception as e:
@@ -425,46 +963,255 @@ class InatUtils:
             else 0.0
         )
 
-    def identify(self, min_score=None, overwrite=True):
+    def identify(
+        self,
+        min_score=None,
+        overwrite=True,
+        concurrency: int = 1,
+        timeout: float = 60,
+        group_bursts: bool = False,
+        burst_window: float = 5,
+        hamming_threshold: int = 10,
+    ):
+        """identifies photos with the computer vision model.
+
+        Args:
+            min_score (int | float, optional): minimum acceptable score. Defaults to self.min_score.
+            overwrite (bool): re-identify photos that are already identified. Default is True.
+            concurrency (int): number of requests in flight at once. Above 1, this runs identify_async (use
+                `await iu.identify_async(...)` directly from a running event loop, e.g. in a notebook). Throughput is
+                still capped by the client's scheduler (`request_rate`, 1 request per second by default), so raise
+                `request_rate` too for concurrency to pay off. Default is 1.
+            timeout (float): timeout in seconds for each HTTP attempt. Default is 60.
+            group_bursts (bool): only send one representative photo per burst of near-duplicates (see
+                group_bursts()) and give its identity to the rest of the burst. Default is False.
+            burst_window (float): maximum seconds between consecutive frames of a burst. Default is 5.
+            hamming_threshold (int): maximum perceptual hash distance between consecutive frames of a burst. Default is 10.
+        """
+        pending = [p for p in self.photos if overwrite or not p.identified]
+        if group_bursts:
+            bursts = self.group_bursts(
+                pending, window=burst_window, max_distance=hamming_threshold
+            )
+        else:
+            bursts = [[p] for p in pending]
+        representatives = [burst[len(burst) // 2] for burst in bursts]
+        if len(representatives) < len(pending):
+            logging.info(
+                f"identifying {len(representatives)} representatives of {len(pending)} photos"
+            )
+
+        # a representative may carry an identity from an earlier run; only propagate ones produced by this run
+        previous = [rep.identity for rep in representatives]
+        if concurrency and concurrency > 1:
+            asyncio.run(
+                self.identify_async(
+                    min_score=min_score,
+                    overwrite=overwrite,
+                    concurrency=concurrency,
+                    timeout=timeout,
+                    photos=representatives,
+                )
+            )
+        else:
+            self._identify_sequential(
+                representatives, min_score=min_score, timeout=timeout
+            )
+        if self.client.scheduler:
+            stats = self.client.scheduler.stats()
+            logging.info(
+                f"{stats['succeeded']} requests succeeded ({stats['throughput']:.2f}/s), {stats['retries']} retries, {stats['throttled']} throttled, {stats['failed']} failed"
+            )
+
+        for burst, rep, identity in zip(bursts, representatives, previous):
+            if not rep.identified or rep.identity is identity:
+                continue
+            for p in burst:
+                if p is not rep:
+                    p.cv_response = rep.cv_response
+                    self._apply_identification(p, rep.identity)
+        self.update_identified_percent()
+
+    def _identify_sequential(self, photos: list, min_score=None, timeout: float = 60):
         prior_identification = None
         if not min_score:
             min_score = self.min_score
-        for p in self.photos:
+        for p in photos:
             try:
-                if p.identified and not overwrite:
-                    logging.debug(f"skipping {p.name} because already identified")
-                    continue
-                res = tools.get_cv_ids(p.path, token=self.token)
+                res = tools.get_cv_ids(
+                    p.path,
+                    token=self.token,
+                    client=self.client,
+                    timeout=timeout,
+                    max_edge=self.cv_max_edge,
+                    cache=self.cv_cache,
+                )
+                p.cv_response = res
                 identification = tools.interpret_results(
                     res,
                     confidence_threshold=min_score,
                     common_ancestor_ok=self.common_ancestor_ok,
                 )
                 if identification:
-                    p.identity = identification
-                    p.identified = True
-                    if p.outputs:  # if has child images, they're also IDd now
-                        for o in p.outputs:
-                            o.identity = identification
-                            o.identified = True
+                    self._apply_identification(p, identification)
                 elif identification == 0 and prior_identification == 0:
                     logging.warning("token appears to have expired--aborting.")
                     break
                 prior_identification = identification
-            except Exception as e:
-                logging.error(e)
-                self.update_identified_percent()
+            except tools.CircuitOpenError as e:
+                logging.warning(f"{e}--aborting.")
                 break
+            except Exception as e:
+                # a bad file or failed request only costs its own photo
+                logging.error(f"identification of {p.name} failed: {e!r}")
+                continue
 
-            # todo: get and implement AppID here to automatically refresh token
+            # todo: get and implement AppID here; until then, TokenProvider's refreshes fall back to the current token
             self.update_identified_percent()
 
-    def update_identified_percent(self):
-        self.identified_percent = (
-            100 * (sum(1 for p in self.photos if p.identified) / len(self.photos))
-            if self.photos
-            else 0.0
+    def group_bursts(
+        self, photos: list = None, window: float = 5, max_distance: int = 10
+    ) -> list[list[Img]]:
+        """groups photos into bursts of near-identical frames taken in quick succession.
+
+        Args:
+            photos (list, optional): photos to group. Defaults to self.photos.
+            window (float): maximum seconds between consecutive frames of a burst. Default is 5.
+            max_distance (int): maximum perceptual hash (tools.dhash) distance between consecutive frames. Default is 10.
+
+        Returns:
+            list[list[Img]]: the bursts, in time order; photos that aren't part of a burst are returned alone.
+        """
+        if photos is None:
+            photos = self.photos
+        unhashed = [p for p in photos if p.phash is None]
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            for p, phash in zip(unhashed, executor.map(_hash_img, unhashed)):
+                p.phash = phash
+
+        hashable = [p for p in photos if p.phash is not None]
+        labels = tools.group_bursts(
+            np.array([p.phash for p in hashable], dtype=np.uint64),
+            tools.to_epoch_ns([p.datetime for p in hashable], fmt=self.timestamp_fmt),
+            window_s=window,
+            max_distance=max_distance,
+        )
+        bursts = {}
+        for label, p in sorted(zip(labels, hashable), key=lambda lp: lp[0]):
+            bursts.setdefault(label, []).append(p)
+        bursts = list(bursts.values())
+        bursts += [[p] for p in photos if p.phash is None]
+        logging.debug(f"grouped {len(photos)} photos into {len(bursts)} bursts")
+        return bursts
+
+    async def identify_async(
+        self,
+        min_score=None,
+        overwrite=True,
+        concurrency: int = 8,
+        timeout: float = 60,
+        photos: list = None,
+    ):
+        """identifies photos with up to `concurrency` computer vision requests in flight at once.
+
+        Each request runs in a dedicated pool of `concurrency` worker threads, and holds its slot until its thread
+        finishes, so no more than `concurrency` requests are ever in flight. `timeout` applies to each HTTP attempt;
+        retries and rate-limit pauses by the client's scheduler aren't cut short. A failed or timed-out request only
+        affects its own photo. Results are applied to `Img.identity` in photo order once all requests finish.
+        As in identify(), two consecutive failed responses are taken to mean the token has expired, and no further
+        requests are started.
+
+        NOTE: concurrency only hides request latency; every request still waits its turn at the client's scheduler,
+        which holds throughput to `request_rate` (1 request per second by default, to stay within the API's rate
+        limits). Pass a higher `request_rate` (or a client with a faster scheduler) to go faster.
+        """
+        if not min_score:
+            min_score = self.min_score
+        if photos is None:
+            photos = self.photos
+        pending = [p for p in photos if overwrite or not p.identified]
+        semaphore = asyncio.Semaphore(concurrency)
+        expired = asyncio.Event()
+        failures = 0
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        async def score(p):
+            nonlocal failures
+            async with semaphore:
+                if expired.is_set():
+                    return None
+                try:
+                    res = await loop.run_in_executor(
+                        executor,
+                        partial(
+                            tools.get_cv_ids,
+                            p.path,
+                            token=self.token,
+                            client=self.client,
+                            timeout=timeout,
+                            max_edge=self.cv_max_edge,
+                            cache=self.cv_cache,
+                        ),
+                    )
+                except tools.CircuitOpenError as e:
+                    if not expired.is_set():
+                        logging.warning(f"{e}--aborting.")
+                        expired.set()
+                    return None
+                except Exception as e:
+                    logging.error(f"identification of {p.name} failed: {e!r}")
+                    return None
+                p.cv_response = res
+
+                identification = tools.interpret_results(
+                    res,
+                    confidence_threshold=min_score,
+                    common_ancestor_ok=self.common_ancestor_ok,
+                )
+                failures = failures + 1 if identification == 0 else 0
+                if failures >= 2 and not expired.is_set():
+                    logging.warning("token appears to have expired--aborting.")
+                    expired.set()
+                return identification
+
+        logging.info(
+            f"identifying {len(pending)} photos with up to {concurrency} concurrent requests"
         )
+        try:
+            results = await asyncio.gather(*(score(p) for p in pending))
+        finally:
+            executor.shutdown(wait=False)
+        for p, identification in zip(pending, results):
+            self._apply_identification(p, identification)
+        self.update_identified_percent()
+
+    def reclassify(self, min_score=None, common_ancestor_ok: bool = None):
+        """re-interprets every photo's stored computer vision response with new settings, without any requests.
+
+        Args:
+            min_score (int | float, optional): minimum acceptable score. Defaults to self.min_score.
+            common_ancestor_ok (bool, optional): allow common-ancestor IDs. Defaults to self.common_ancestor_ok.
+        """
+        if not min_score:
+            min_score = self.min_score
+        if common_ancestor_ok is None:
+            common_ancestor_ok = self.common_ancestor_ok
+        for p in self.photos:
+            if not p.cv_response:
+                continue
+            identification = tools.interpret_results(
+                p.cv_response,
+                confidence_threshold=min_score,
+                common_ancestor_ok=common_ancestor_ok,
+            )
+            if identification:
+                self._apply_identification(p, identification)
+            else:
+                for img in [p] + p.outputs:
+                    img.identity = dict()
+                    img.identified = False
+        self.update_identified_percent()
 
     # region exports/uploads
     def save(
@@ -476,11 +1223,29 @@ class InatUtils:
         out_fmt: str = "JPEG",
         max_timedelta: int = 5000,
         recycle_names: bool = False,
+        lossless: bool = True,
+        beside_originals: bool = False,
+        workers: int = None,
         # overwrite: bool = True,
         # max_time: str|datetime.datetime = None,
         # min_time: str|datetime.datetime = None,
         # bounds: tuple = None,
     ):
+        """exports photos, with their georeferencing EXIF, to `output_dir`.
+
+        With `lossless` (the default), JPEG photos exported as JPEG are copied with their EXIF segment replaced
+        (tools.splice_jpeg_exif) instead of being decoded and re-encoded, so the image data is bit-exact. Photos whose
+        raster has been replaced, or whose EXIF is too large to splice, are re-encoded.
+
+        With `out_fmt="XMP"`, no images are written: each photo gets an XMP sidecar (`<stem>.xmp`, or
+        `<name>.xmp` for RAW+JPEG pairs) carrying its matched position, capture time and identification, in
+        `output_dir` or, with `beside_originals`, next to the original. This leaves RAW/HEIC files untouched, and the
+        path is recorded in `Img.sidecar`. Existing sidecars from other software are never overwritten.
+
+        Output names are planned up front against a single listing of `output_dir`, then files are written across
+        `workers` processes (default self.export_workers). Exports are recorded in each photo's `outputs` from the source's
+        metadata rather than by reading the written files back.
+        """
         exports = []
         if not output_dir:
             output_dir = self.output_dir
@@ -535,60 +1300,416 @@ class InatUtils:
                 for p in exports
                 if p.geo.get("delta", True) and p.geo.get("delta") < max_timedelta
             ]
+        if str(out_fmt).lower() == "xmp":
+            logging.info(f"writing {len(exports)} XMP sidecars")
+            shared_stems = self._shared_stems(exports)
+            for p in exports:
+                try:
+                    self._export_sidecar(
+                        p,
+                        os.path.dirname(p.path) if beside_originals else output_dir,
+                        shared_stems,
+                    )
+                except Exception as e:
+                    logging.error(e)
+            return
+
         logging.info(f"exporting {len(exports)} photos to {output_dir}")
+        self._export_photos(
+            exports, output_dir, out_fmt, recycle_names, lossless, workers
+        )
 
-        for p in exports:
+    def _export_photos(
+        self,
+        exports: list[Img],
+        output_dir: str,
+        out_fmt: str,
+        recycle_names: bool,
+        lossless: bool,
+        workers: int = None,
+        taken: set = None,
+    ):
+        """writes `exports` to `output_dir` and records them in each photo's `outputs` (see save()).
+        `taken` is the set of names already used in `output_dir`; pass the same set to concurrent calls so they
+        can't claim the same name. Defaults to a fresh listing of `output_dir`.
+        """
+        if taken is None:
+            taken = self._output_names(output_dir)
+            if taken is None:
+                return
+        jobs = []
+        for i, p in enumerate(exports):
             logging.debug(
-                f"""   {exports.index(p)/len(exports):.2%} exported.
+                f"""   planning {i + 1}/{len(exports)}
                 photo time:   {p.datetime}
                 iu tz:        {self.offset}
-                matched time: {p.geo['t']}
-                delta:        {p.geo['delta']}
-                x:            {p.geo['x']}
-                y:            {p.geo['y']}
+                matched time: {p.geo.get('t')}
+                delta:        {p.geo.get('delta')}
+                x:            {p.geo.get('x')}
+                y:            {p.geo.get('y')}
                 name:         {p.name}
                 """
             )
             try:
-                # outname = p.name.strip(p.name[p.name.index(".") :])
-                if recycle_names:
-                    outname = p.name
-                else:
-                    outname = ""
-                    if not out_fmt:
-                        out_fmt = p.format
-
-                    if p.datetime:
-                        outname += f"_{p.datetime.replace(':', '').replace(' ', '_')}"[
-                            2:
-                        ]
-
-                    if p.identified:
-                        if p.identity["rank"] == "species":
-                            outname += f"_{p.identity['name']}"
-                        else:
-                            outname += f"_{p.identity['rank']}_{p.identity['name']}"
+                fmt = out_fmt or p.format.lstrip(".")
+                # serialized here so a source that can no longer be read fails alone, before it claims a name
+                exif = self._export_exif(p).tobytes() if p._raster is None else None
+                with self._names_lock:
+                    outname = self._plan_outname(p, fmt, recycle_names, taken)
+                    taken.add(outname)
+                jobs.append((p, os.path.join(output_dir, outname), fmt, exif))
+            except Exception as e:
+                logging.error(f"failed to export {p.name}: {e}")
+
+        if workers is None:
+            workers = self.export_workers
+        # edited rasters only exist in this process, so they're encoded here; everything else is encoded from its file
+        edited = [job[:3] for job in jobs if job[0]._raster is not None]
+        args = [
+            (p.path, out_path, fmt, exif, lossless)
+            for p, out_path, fmt, exif in jobs
+            if p._raster is None
+        ]
+        jobs = [job[:3] for job in jobs if job[0]._raster is None]
+        if workers and workers > 1 and len(args) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                errors = list(
+                    executor.map(
+                        _export_img,
+                        *zip(*args),
+                        chunksize=max(1, len(args) // (workers * 4)),
+                    )
+                )
+        else:
+            errors = [_export_img(*a) for a in args]
 
-                    if p.georeferenced:
-                        outname += "_geo"
+        for p, out_path, fmt in edited:
+            try:
+                p.raster.save(
+                    out_path, format=_pil_format(fmt), exif=self._export_exif(p)
+                )
+                errors.append(None)
+            except Exception as e:
+                errors.append(str(e))
+        jobs += edited
 
-                    if outname in os.listdir(output_dir):
-                        logging.debug(
-                            f"file {outname} already exists in output directory; appending unique ID to filename"
-                        )
-                        outname += f"_{p.id[:2]}"
+        for (p, out_path, fmt), error in zip(jobs, errors):
+            if error:
+                logging.error(f"failed to export {p.name}: {error}")
+                continue
+            # the output's header is known from its source; no need to read it back
+            metadata = p.metadata()
+            if p.georeferenced:
+                metadata["geo"] = {k: p.geo[k] for k in ("x", "y", "z") if k in p.geo}
+                metadata["make"] = self.camera_make or metadata["make"]
+                metadata["model"] = self.camera_model or metadata["model"]
+            res = self.Img(path=out_path, offset=p.offset, metadata=metadata)
+            res.src = p.id
+            p.outputs.append(res)
+
+    def stream(
+        self,
+        photo_dir: str = None,
+        output_dir: str = None,
+        out_fmt: str = "JPEG",
+        max_timedelta: int = 5000,
+        recycle_names: bool = False,
+        lossless: bool = True,
+        batch_size: int = 64,
+        workers: int = None,
+    ):
+        """loads, matches, georeferences and exports the photos in `photo_dir` as a pipeline, yielding each Img once
+        its export is written.
 
-                    if p.format:
-                        outname += f".{out_fmt}"
+        Unlike the constructor + save(), photos aren't collected in `self.photos`: they're read in batches of
+        `batch_size`, each batch is processed end to end by one of `workers` threads, and at most `2 * workers`
+        batches are in flight. Memory therefore stays constant however large the directory is, and the first outputs
+        appear once the first batch is done. Waypoints must already be loaded (see get_waypoints()).
 
-                p.raster.save(
-                    os.path.join(output_dir, outname), format=out_fmt, exif=p.exif
+        Args:
+            photo_dir (str, optional): directory to read photos from. Defaults to self.photo_dir.
+            output_dir (str, optional): directory to export to. Defaults to self.output_dir.
+            out_fmt (str): export format, as in save(); "XMP" writes sidecars. Default is "JPEG".
+            max_timedelta (int): photos matched further than this many minutes from a trackpoint (or not matched) are
+                yielded without being exported; None exports everything. Default is 5000.
+            recycle_names (bool): export under the original file names. Default is False.
+            lossless (bool): splice EXIF into JPEGs instead of re-encoding them, as in save(). Default is True.
+            batch_size (int): photos per batch. Default is 64.
+            workers (int, optional): number of batches processed in parallel. Defaults to self.workers.
+
+        Yields:
+            Img: each photo, georeferenced and with its export in `outputs` (or `sidecar`), in directory order.
+        """
+        photo_dir = photo_dir or self.photo_dir
+        output_dir = output_dir or self.output_dir
+        workers = max(1, workers or self.workers or 1)
+        if self.waypoints.empty:
+            logging.warning("no waypoints loaded; photos will not be georeferenced")
+
+        paths = (
+            entry.path
+            for entry in os.scandir(photo_dir)
+            if entry.is_file()
+            and not entry.name.startswith(".")
+            and entry.name.lower().endswith(tuple(self.photo_formats))
+        )
+        taken = self._output_names(output_dir)
+        if taken is None:
+            return
+
+        def process(batch: list[str]) -> list[InatUtils.Img]:
+            photos = []
+            for path in batch:
+                photo, error = _load_img(path, self.offset)
+                if error:
+                    logging.error(f"failed to load {path}: {error}")
+                    self.load_errors[path] = error
+                    continue
+                photos.append(photo)
+            try:
+                return self._process_batch(
+                    photos,
+                    output_dir,
+                    out_fmt,
+                    max_timedelta,
+                    recycle_names,
+                    lossless,
+                    taken,
                 )
-                res = self.Img(path=os.path.join(output_dir, outname), offset=p.offset)
-                res.src = p.id
-                p.outputs.append(res)
             except Exception as e:
-                logging.error(e)
+                # one bad batch shouldn't end the stream; its photos are yielded as they stand
+                logging.error(f"failed to process batch starting {batch[0]}: {e}")
+                return photos
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque()
+            while batch := list(islice(paths, batch_size)):
+                in_flight.append(executor.submit(process, batch))
+                # backpressure: don't read further ahead than the consumer has taken
+                if len(in_flight) >= 2 * workers:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+
+    def watch(
+        self,
+        photo_dir: str = None,
+        gpx_dir: str = None,
+        output_dir: str = None,
+        out_fmt: str = "JPEG",
+        max_timedelta: int = 5000,
+        recycle_names: bool = False,
+        lossless: bool = True,
+        interval: float = 2.0,
+        stop: threading.Event = None,
+    ):
+        """watches `photo_dir` and `gpx_dir`, and processes photos as they arrive, yielding each one once exported.
+
+        Photos that appear or change (once they've finished copying) are loaded, matched, georeferenced and exported
+        as in stream(), and kept in `self.photos`. When a GPX file appears or changes, its track is added to the
+        waypoints and every photo that wasn't exported for lack of a match is matched again. Files present when
+        watching starts are left alone; process those with the constructor or stream() first.
+
+        Directories are polled every `interval` seconds, or watched through filesystem events if the optional
+        `watchdog` package is installed (see tools.DirectoryWatcher).
+
+        Args:
+            photo_dir (str, optional): directory to watch for photos. Defaults to self.photo_dir.
+            gpx_dir (str, optional): directory to watch for GPX tracks. Defaults to self.gpx_dir.
+            output_dir (str, optional): directory to export to. Defaults to self.output_dir.
+            out_fmt (str): export format, as in save(); "XMP" writes sidecars. Default is "JPEG".
+            max_timedelta (int): photos matched further than this many minutes from a trackpoint aren't exported
+                (yet); None exports everything. Default is 5000.
+            recycle_names (bool): export under the original file names. Default is False.
+            lossless (bool): splice EXIF into JPEGs instead of re-encoding them, as in save(). Default is True.
+            interval (float): seconds between directory scans. Default is 2.0.
+            stop (threading.Event, optional): set it to stop watching; otherwise watch until interrupted.
+
+        Yields:
+            Img: each newly processed (or newly matched) photo.
+        """
+        photo_dir = photo_dir or self.photo_dir
+        gpx_dir = gpx_dir or self.gpx_dir
+        output_dir = output_dir or self.output_dir
+        watched = {photo_dir: self.photo_formats}
+        if gpx_dir:
+            watched[gpx_dir] = ["gpx"]
+        taken = self._output_names(output_dir)
+        if taken is None:
+            return
+        watcher = tools.DirectoryWatcher(watched, interval=interval)
+        # load_images() stores absolute paths and the watcher reports them as found, so compare both absolute
+        by_path = {os.path.abspath(p.path): p for p in self.photos}
+        logging.info(f"watching {', '.join(watched)} for new files")
+
+        try:
+            while not (stop and stop.is_set()):
+                changed = watcher.poll()
+                if not changed:
+                    continue
+                gpx_files = [f for f in changed if f.lower().endswith(".gpx")]
+
+                retry = []
+                if gpx_files:
+                    stores = [self.waypoints]
+                    for gpx in gpx_files:
+                        store, error = _read_gpx(gpx, self.cache_waypoints)
+                        if error:
+                            logging.error(f"failed to parse {gpx}: {error}")
+                        else:
+                            stores.append(store)
+                    self.waypoints = tools.WaypointStore.concat(stores)
+                    retry = [
+                        p
+                        for p in self.photos
+                        if not (p.geo and _within(p.geo, max_timedelta))
+                    ]
+
+                new = []
+                for path in changed:
+                    if path in gpx_files:
+                        continue
+                    path = os.path.abspath(path)
+                    photo, error = _load_img(path, self.offset)
+                    if error:
+                        logging.error(f"failed to load {path}: {error}")
+                        self.load_errors[path] = error
+                        continue
+                    if path in by_path:
+                        self.photos.remove(by_path[path])
+                        retry = [p for p in retry if p is not by_path[path]]
+                    by_path[path] = photo
+                    self.photos.append(photo)
+                    new.append(photo)
+
+                if new or retry:
+                    logging.info(
+                        f"processing {len(new)} new and {len(retry)} previously unmatched photos"
+                    )
+                    yield from self._process_batch(
+                        new + retry,
+                        output_dir,
+                        out_fmt,
+                        max_timedelta,
+                        recycle_names,
+                        lossless,
+                        taken,
+                    )
+        finally:
+            watcher.stop()
+
+    def _process_batch(
+        self,
+        photos: list[Img],
+        output_dir: str,
+        out_fmt: str,
+        max_timedelta: int,
+        recycle_names: bool,
+        lossless: bool,
+        taken: set,
+    ) -> list[Img]:
+        """matches, georeferences and exports a batch of loaded photos for stream() and watch()"""
+        if not self.waypoints.empty:
+            self.match_waypoints(photos=photos)
+        for p in photos:
+            if p.geo:
+                self.georeference_image(p)
+        exports = [p for p in photos if _within(p.geo, max_timedelta)]
+        if str(out_fmt).lower() == "xmp":
+            shared_stems = self._shared_stems(exports)
+            for p in exports:
+                try:
+                    self._export_sidecar(p, output_dir, shared_stems)
+                except Exception as e:
+                    logging.error(e)
+        else:
+            self._export_photos(
+                exports, output_dir, out_fmt, recycle_names, lossless, 1, taken
+            )
+        return photos
+
+    def _output_names(self, output_dir: str) -> set | None:
+        """creates `output_dir` if needed and returns the names already in it, or None (logged) if it can't be used"""
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            return set(os.listdir(output_dir))
+        except Exception as e:
+            logging.error(f"can't export to {output_dir}: {e}")
+            return None
+
+    def _plan_outname(self, p: Img, fmt: str, recycle_names: bool, taken: set) -> str:
+        """names `p`'s export, appending as much of its id as needed to avoid the names in `taken`"""
+        if recycle_names:
+            return p.name
+        outname = ""
+        if p.datetime:
+            outname += f"_{p.datetime.replace(':', '').replace(' ', '_')}"[2:]
+
+        if p.identified:
+            if p.identity["rank"] == "species":
+                outname += f"_{p.identity['name']}"
+            else:
+                outname += f"_{p.identity['rank']}_{p.identity['name']}"
+
+        if p.georeferenced:
+            outname += "_geo"
+
+        ext = f".{fmt}" if p.format else ""
+        stem, n = outname, 2
+        while outname + ext in taken:
+            logging.debug(
+                f"file {outname + ext} already exists in output directory; appending unique ID to filename"
+            )
+            outname = f"{stem}_{p.id[:n]}"
+            n += 1
+        return outname + ext
+
+    def _export_sidecar(
+        self, p: Img, output_dir: str, shared_stems: set = frozenset()
+    ) -> str | None:
+        """writes an XMP sidecar for `p` into `output_dir`, named after the original so editors pair them up.
+
+        The sidecar is `<stem>.xmp` unless another photo in the same folder shares the stem (e.g. a RAW+JPEG pair,
+        see _shared_stems()), in which case it's `<name>.xmp` (e.g. `IMG_1.cr2.xmp`) so the pair don't overwrite
+        each other. An existing sidecar that wasn't written by this tool (e.g. by Lightroom or darktable) is left
+        alone, and nothing is written.
+        """
+        stem = os.path.splitext(p.name)[0]
+        if (p.folder, stem.lower()) in shared_stems:
+            stem = p.name
+        path = os.path.join(output_dir, stem + ".xmp")
+        if os.path.exists(path) and not tools.is_own_sidecar(path):
+            logging.warning(
+                f"not writing a sidecar for {p.name}: {path} already exists and wasn't written by this tool"
+            )
+            return None
+        with open(path, "wb") as f:
+            f.write(
+                tools.build_xmp_sidecar(
+                    geo=p.geo,
+                    local_timestamp=p.exif_datetime,
+                    utc_timestamp=p.datetime,
+                    identity=p.identity if p.identified else None,
+                    make=self.camera_make or p.camera_make,
+                    model=self.camera_model or p.camera_model,
+                )
+            )
+        p.sidecar = path
+        return path
+
+    def _shared_stems(self, photos: list[Img]) -> set:
+        """returns the (folder, lower-case stem) pairs that name more than one photo file in the photos' folders"""
+        shared = set()
+        for folder in {p.folder for p in photos}:
+            seen = set()
+            for name in os.listdir(folder):
+                if not name.lower().endswith(tuple(self.photo_formats)):
+                    continue
+                stem = os.path.splitext(name)[0].lower()
+                if stem in seen:
+                    shared.add((folder, stem))
+                seen.add(stem)
+        return shared
 
     def dump_csv(self):
         # TODO: implement filters here for time delta, trusted genera, and whatever else
@@ -604,6 +1725,72 @@ class InatUtils:
 
         # return ((min_lon, min_lat), (max_lon, max_lat))
 
+def _load_img(path: str, offset: int, metadata: dict = None):
+    """builds an InatUtils.Img, returning (img, None) on success or (None, error message) on failure.
+    module-level so that it can be sent to a process pool.
+    """
+    try:
+        return InatUtils.Img(path=path, offset=offset, metadata=metadata), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _within(geo: dict, max_timedelta: int = None) -> bool:
+    """whether a photo's match (`Img.geo`) is close enough in time to export; any match passes without a limit"""
+    if max_timedelta is None:
+        return True
+    return bool(geo) and geo.get("delta", max_timedelta) < max_timedelta
+
+
+def _pil_format(fmt: str) -> str:
+    """maps a file extension-style format (e.g. "jpg") to the name PIL saves it under (e.g. "JPEG")"""
+    return PIL.Image.registered_extensions().get(f".{fmt.lower()}", fmt.upper())
+
+
+def _export_img(
+    src_path: str, out_path: str, fmt: str, exif: bytes, lossless: bool = True
+):
+    """writes one export, returning None on success or an error message on failure.
+    JPEG-to-JPEG exports splice the new EXIF into a copy of the file (see tools.splice_jpeg_exif) when `lossless`;
+    anything else is decoded and re-encoded. module-level so that it can be sent to a process pool.
+    """
+    jpeg = ("jpg", "jpeg")
+    try:
+        if (
+            lossless
+            and os.path.splitext(src_path)[1].lower().strip(".") in jpeg
+            and fmt.lower() in jpeg
+        ):
+            try:
+                tools.splice_jpeg_exif(src_path, out_path, exif)
+                return None
+            except ValueError as e:
+                logging.debug(f"re-encoding {src_path}: {e}")
+        with PIL.Image.open(src_path) as raster:
+            raster.save(out_path, format=_pil_format(fmt), exif=exif)
+        return None
+    except Exception as e:
+        return str(e)
+
+
+def _hash_img(p: InatUtils.Img):
+    try:
+        return tools.dhash(p.path)
+    except Exception as e:
+        logging.error(f"could not hash {p.name}: {e}")
+        return None
+
+
+def _read_gpx(path: str, cache: bool = False):
+    """parses a GPX file, returning (WaypointStore, None) on success or (None, error message) on failure.
+    module-level so that it can be sent to a process pool.
+    """
+    try:
+        return tools.WaypointStore.from_gpx(path, cache=cache), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
 # For debugging
 # iu = InatUtils(log_level="DEBUG")
 # iu.identify()
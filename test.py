@@ -1,7 +1,6 @@
 # %%
 from inatutils import InatUtils
 # import pandas as pd
-import datetime
 import numpy as np
 import time
 
@@ -21,32 +20,20 @@ while True:
     iu.output_dir = "C:/Users/SamGartrell/Desktop/inat"
 
     print(iu.photos[235].__dict__)
-    img_offset = input("how many hours should be added to each photo's datetime? ")
-    subtract = False
+    # score every offset from -12h to +12h in 15 minute steps against the loaded tracks
+    sweep = iu.sweep_offsets(np.arange(-12, 12.25, 0.25), max_timedelta=5)
+    print(sweep.head(10))
+    img_offset = input(
+        f"how many hours should be added to each photo's datetime? (best: {sweep.offset[0]}) "
+    )
     if img_offset:
-        if img_offset.startswith("-"):
-            subtract = False
-        if img_offset.strip("-").isdigit():
-            img_offset = int(img_offset)
-            for p in iu.photos:
-                if subtract:
-                    p.datetime = (
-                        datetime.datetime.strptime(p.datetime, "%Y:%m:%d %H:%M:%S")
-                        - datetime.timedelta(hours=img_offset)
-                    ).strftime("%Y:%m:%d %H:%M:%S")
-                else:
-                    p.datetime = (
-                        datetime.datetime.strptime(p.datetime, "%Y:%m:%d %H:%M:%S")
-                        + datetime.timedelta(hours=img_offset)
-                    ).strftime("%Y:%m:%d %H:%M:%S")
-            print("updated photos. re-matching...")
-            print("    getting waypoints...")
-            iu.get_waypoints(gpx_dir=iu.gpx_dir)
-            print("    matching waypoints...")
-            iu.match_waypoints()
-            print("    georeferencing images...")
-            iu.georeference()
+        try:
+            img_offset = float(img_offset)
+            print("applying offset and re-matching...")
+            iu.apply_offset(img_offset)
             iu.sort(by="timedelta", ascending=False)
+        except ValueError:
+            print(f"couldn't read {img_offset} as a number of hours; no offset applied")
 
     else:
         print("no offset applied")
@@ -0,0 +1,6 @@
+# run from the repo root: python -m pytest tests
+import os
+import sys
+
+# the repo root is a package itself, so make its modules importable the way inatutils.py imports them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils import tools
+
+S = 1_000_000_000
+T0 = np.int64(1_714_000_000 * S)
+
+
+def test_group_bursts_joins_frames_within_window():
+    same = np.full(3, 5, dtype=np.uint64)
+    labels = tools.group_bursts(same, np.array([T0, T0 + 1 * S, T0 + 2 * S]))
+    assert len(set(labels)) == 1, labels
+
+
+def test_group_bursts_splits_on_gap():
+    same = np.full(3, 5, dtype=np.uint64)
+    labels = tools.group_bursts(same, np.array([T0, T0 + 1 * S, T0 + 60 * S]))
+    assert labels[0] == labels[1] != labels[2], labels
+
+
+def test_group_bursts_never_groups_untimed_photos():
+    # t - NAT_NS overflows int64, so the window check alone would let them through
+    same = np.full(3, 5, dtype=np.uint64)
+    labels = tools.group_bursts(same, np.array([tools.NAT_NS, T0, T0 + 1 * S]))
+    assert labels[0] not in labels[1:] and labels[1] == labels[2], labels
+    labels = tools.group_bursts(same, np.array([tools.NAT_NS, tools.NAT_NS, T0]))
+    assert len(set(labels)) == 3, labels
+
+
+H = 3600 * S
+MINUTE = 60 * S
+
+
+def gappy_track(days=10, hours=4, step=10 * S):
+    """one `hours`-long segment a day, a trackpoint every `step` ns"""
+    return np.concatenate(
+        [T0 + d * 24 * H + 8 * H + np.arange(0, hours * H + 1, step) for d in range(days)]
+    ).astype(np.int64)
+
+
+def photos_on(days=10, hours=4, n=2000, seed=0):
+    """`n` true photo times spread over the segments of gappy_track()"""
+    rng = np.random.default_rng(seed)
+    day = rng.integers(0, days, n)
+    return np.sort(T0 + day * 24 * H + 8 * H + rng.integers(0, hours * H, n))
+
+
+def test_estimate_offset_recovers_offset_on_gappy_track():
+    track, true_t = gappy_track(), photos_on()
+    coarse = np.arange(-14 * H, 14 * H + 1, 15 * MINUTE)
+    for correction in (int(0.617 * H), -2 * H):
+        offset, stats = tools.estimate_offset(
+            true_t - correction, track, coarse, refine_step=MINUTE, max_gap=5 * MINUTE
+        )
+        assert abs(offset - correction) <= MINUTE, (offset / H, correction / H)
+        # pinned down to within a fine step, so estimate_offsets() applies it
+        assert stats["ambiguity"] <= MINUTE, stats["ambiguity"] / MINUTE
+
+
+def test_estimate_offset_reports_unconstrained_offsets_as_ambiguous():
+    # photos well inside one long segment fit any offset that keeps them on it
+    track = T0 + np.arange(0, 12 * H + 1, 10 * S)
+    true_t = T0 + 5 * H + np.arange(0, 2 * H, MINUTE)
+    coarse = np.arange(-2 * H, 2 * H + 1, 15 * MINUTE)
+    offset, stats = tools.estimate_offset(
+        true_t, track, coarse, refine_step=MINUTE, max_gap=5 * MINUTE
+    )
+    assert stats["ambiguity"] > 2 * H, stats["ambiguity"] / H
+
+
+def test_drift_samples_recover_offset_and_rate():
+    # the camera runs 5 minutes slow at the start and loses another minute a day
+    track, true_t = gappy_track(), photos_on()
+    truth = (300 + 60 * (true_t - true_t[0]) / (24 * H)) * S
+    camera_t = true_t - truth.astype(np.int64)
+    overall, _ = tools.estimate_offset(
+        camera_t,
+        track,
+        np.arange(-14 * H, 14 * H + 1, 15 * MINUTE),
+        refine_step=10 * S,
+        max_gap=5 * MINUTE,
+    )
+    samples = tools.drift_samples(
+        camera_t,
+        track,
+        overall,
+        window=24 * H,
+        max_drift=10 * MINUTE,
+        refine_step=10 * S,
+        max_gap=5 * MINUTE,
+        max_ambiguity=10 * MINUTE,
+    )
+    assert len(samples[0]) >= 5, samples
+    model = tools.ClockDriftModel.fit(*samples[:2], uncertainty=samples[2])
+    assert abs(model.rate - 60) < 5, model.rate
+    errors = (model.correction(camera_t) - truth) / S
+    assert np.abs(errors).max() < 30, np.abs(errors).max()
+
+
+def _jpeg(path, timestamp):
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[36867] = timestamp
+    Image.new("RGB", (64, 48), (30, 120, 60)).save(path, exif=exif, quality=90)
+
+
+def test_splice_jpeg_exif_replaces_exif_and_keeps_image_data(tmp_path):
+    src, dst = tmp_path / "src.jpg", tmp_path / "dst.jpg"
+    _jpeg(src, "2024:05:01 08:10:00")
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[36867] = "2024:05:02 09:00:00"
+    exif[34853] = {1: "N", 2: (45.0, 30.0, 0.0), 3: "W", 4: (122.0, 15.0, 0.0)}
+    tools.splice_jpeg_exif(str(src), str(dst), exif.tobytes())
+
+    # everything from the start of scan on is copied byte for byte
+    src_bytes, dst_bytes = src.read_bytes(), dst.read_bytes()
+    assert src_bytes[src_bytes.index(b"\xff\xda") :] == dst_bytes[dst_bytes.index(b"\xff\xda") :]
+
+    header = tools.read_exif_header(str(dst))
+    assert header["timestamp"] == "2024:05:02 09:00:00", header
+    assert abs(header["geo"]["y"] - 45.5) < 1e-6 and abs(header["geo"]["x"] + 122.25) < 1e-6, header["geo"]
+
+
+def test_splice_jpeg_exif_rejects_non_jpeg(tmp_path):
+    src = tmp_path / "src.png"
+    src.write_bytes(b"\x89PNG\r\n\x1a\n")
+    with pytest.raises(ValueError):
+        tools.splice_jpeg_exif(str(src), str(tmp_path / "dst.jpg"), b"Exif\x00\x00")